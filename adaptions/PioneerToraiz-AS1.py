@@ -8,6 +8,32 @@ import hashlib
 
 CANNOT_FIND_DATA_BLOCK = "Cannot find the message's data block."
 
+TORAIZ_HEADER = [0xf0,
+                 0b00000000, 0b01000000, 0b00000101,  # Pioneer ID
+                 0b00000000, 0b00000000, 0b00000001, 0b00001000,  # Toraiz ID
+                 0b00010000]  # Device ID
+_TORAIZ_HEADER_LENGTH = len(TORAIZ_HEADER)
+PROGRAM_DUMP = 0b00000010
+EDIT_BUFFER_DUMP = 0b00000011
+
+# Position of the patch name within the unpacked patch data
+NAME_OFFSET = 107
+NAME_LENGTH = 20
+# The sysex data block packs 7 bytes of patch data into groups of 8 bytes, these are the 7 byte chunks holding the name
+_NAME_FIRST_CHUNK = NAME_OFFSET // 7
+_NAME_END_CHUNK = (NAME_OFFSET + NAME_LENGTH + 6) // 7
+_NAME_CHUNK_OFFSET = NAME_OFFSET - _NAME_FIRST_CHUNK * 7
+# The fingerprint is calculated with this in place of the name
+_BLANK_NAME = b" " * NAME_LENGTH
+
+# For each of the 7 data bytes in a sysex group, a translation table from the msbits byte to the byte's high bit
+_HIGH_BIT_OF_COLUMN = tuple(bytes((msbits << (7 - i)) & 0x80 for msbits in range(256)) for i in range(7))
+
+# The other way round, the low 7 bits of a byte, and for each column where its high bit goes in the msbits byte
+_LOW_BITS = bytes(byte & 0x7f for byte in range(256))
+_MSBIT_OF_COLUMN = tuple(bytes((byte >> 7) << i for byte in range(256)) for i in range(7))
+
+
 def name():
     return "Pioneer Toraiz AS-1"
 
@@ -54,17 +80,7 @@ def createEditBufferRequest(channel):
 
 def isEditBufferDump(message):
     # see page 35 of the manual
-    return (len(message) > 9
-            and message[0] == 0xf0
-            and message[1] == 0b00000000  # Pioneer ID byte 1
-            and message[2] == 0b01000000  # Pioneer ID byte 2
-            and message[3] == 0b00000101  # Pioneer ID byte 3
-            and message[4] == 0b00000000  # Toriaz ID byte 1
-            and message[5] == 0b00000000  # Toriaz ID byte 2
-            and message[6] == 0b00000001  # Toriaz ID byte 3
-            and message[7] == 0b00001000  # Toriaz ID byte 4
-            and message[8] == 0b00010000  # Device ID
-            and message[9] == 0b00000011)  # Edit Buffer Dump
+    return _messageType(message) == EDIT_BUFFER_DUMP
 
 
 def numberOfBanks():
@@ -75,16 +91,10 @@ def numberOfPatchesPerBank():
     return 100
 
 
-def getZeroBasedBankNumber(patch_number):
-    """Takes a zero-based patch number and returns the corresponding zero-based bank number."""
-    return patch_number // numberOfPatchesPerBank()
-
-
 def createProgramDumpRequest(channel, patchNo):
     # Calculate bank and program - the KnobKraft Orm will just think the patches are 0 to 999, but the Toraiz needs a
     # bank number 0-9 and the patch number within that bank
-    bank = getZeroBasedBankNumber(patchNo)
-    program = patchNo % numberOfPatchesPerBank()
+    bank, program = divmod(patchNo, numberOfPatchesPerBank())
     # See page 33 of the Toraiz manual
     return [0xf0, 0b00000000, 0b01000000, 0b00000101, 0b00000000, 0b000000000, 0b00000001, 0b00001000, 0b00010000,
             0b00000101, bank, program, 0xf7]
@@ -92,17 +102,16 @@ def createProgramDumpRequest(channel, patchNo):
 
 def isSingleProgramDump(message):
     # see page 34 of the manual
-    return (len(message) > 9
-            and message[0] == 0xf0
-            and message[1] == 0b00000000  # Pioneer ID byte 1
-            and message[2] == 0b01000000  # Pioneer ID byte 2
-            and message[3] == 0b00000101  # Pioneer ID byte 3
-            and message[4] == 0b00000000  # Toriaz ID byte 1
-            and message[5] == 0b00000000  # Toriaz ID byte 2
-            and message[6] == 0b00000001  # Toriaz ID byte 3
-            and message[7] == 0b00001000  # Toriaz ID byte 4
-            and message[8] == 0b00010000  # Device ID
-            and message[9] == 0b00000010)  # Program Dump
+    return _messageType(message) == PROGRAM_DUMP
+
+
+def _messageType(message):
+    """Returns the command byte of a Toraiz patch dump, or None if the message is not one."""
+    if (len(message) > _TORAIZ_HEADER_LENGTH
+            and message[_TORAIZ_HEADER_LENGTH] in (PROGRAM_DUMP, EDIT_BUFFER_DUMP)
+            and message[:_TORAIZ_HEADER_LENGTH] == TORAIZ_HEADER):
+        return message[_TORAIZ_HEADER_LENGTH]
+    return None
 
 
 def nameFromDump(message):
@@ -111,10 +120,12 @@ def nameFromDump(message):
     dataBlockStart = getDataBlockStart(message)
     if dataBlockStart == -1:
         return INVALID
-    dataBlock = message[dataBlockStart:-1]
-    if len(dataBlock) > 0:
-        patchData = unescapeSysex(dataBlock)
-        return ''.join([chr(x) for x in patchData[107:107+20]])
+    if len(message) - 1 > dataBlockStart:
+        # Only the sysex groups holding the name need to be unpacked, and the name bytes are decoded in one go
+        nameGroupsStart = dataBlockStart + _NAME_FIRST_CHUNK * 8
+        nameGroupsEnd = min(dataBlockStart + _NAME_END_CHUNK * 8, len(message) - 1)
+        nameChunks = unescapeSysex(message[nameGroupsStart:nameGroupsEnd])
+        return nameChunks[_NAME_CHUNK_OFFSET:_NAME_CHUNK_OFFSET + NAME_LENGTH].decode('latin-1')
     return INVALID
 
 
@@ -123,20 +134,24 @@ def renamePatch(message, new_name):
     dataBlockStart = getDataBlockStart(message)
     if dataBlockStart == -1:
         raise Exception(CANNOT_FIND_DATA_BLOCK)
-    dataBlock = message[dataBlockStart:-1]
-    if len(dataBlock) == 0:
+    if len(message) - 1 <= dataBlockStart:
         raise Exception("Data block length was 0.")
-    patchData = unescapeSysex(dataBlock)
-    # Normalize the name to exactly 20 characters, padding with spaces or truncating.
-    if len(new_name) < 20:
-        new_name += (" " * (20 - len(new_name)))
-    elif len(new_name) > 20:
-        new_name = new_name[:20]
-    nameBytes = list(map(ord, new_name))
-    patchData[107:107+20] = nameBytes
+    # Normalize the name to exactly 20 characters, padding with spaces or truncating. Characters that don't fit into a
+    # byte are replaced with a question mark, so any name can be set.
+    nameBytes = new_name[:NAME_LENGTH].ljust(NAME_LENGTH).encode('latin-1', 'replace')
+    nameGroupsStart = dataBlockStart + _NAME_FIRST_CHUNK * 8
+    nameGroupsEnd = dataBlockStart + _NAME_END_CHUNK * 8
+    if nameGroupsEnd <= len(message) - 1:
+        # Only the 8 byte sysex groups holding the name need to be unpacked, patched and packed again
+        nameChunks = unescapeSysex(message[nameGroupsStart:nameGroupsEnd])
+        nameChunks[_NAME_CHUNK_OFFSET:_NAME_CHUNK_OFFSET + NAME_LENGTH] = nameBytes
+        return message[:nameGroupsStart] + list(escapeToSysex(nameChunks)) + message[nameGroupsEnd:]
+    # The data block is too short to contain the complete name, so go through the whole of it
+    patchData = unescapeSysex(message[dataBlockStart:-1])
+    patchData[NAME_OFFSET:NAME_OFFSET + NAME_LENGTH] = nameBytes
     escapedPatchData = escapeToSysex(patchData)
     # Rebuild the message with the new data block, appending "end of exclusive" (EOX).
-    newMessage = message[:dataBlockStart] + escapedPatchData + [0xF7]
+    newMessage = message[:dataBlockStart] + list(escapedPatchData) + [0xF7]
     return newMessage
 
     
@@ -146,77 +161,84 @@ def calculateFingerprint(message):
     if dataBlockStart == -1:
         raise Exception(CANNOT_FIND_DATA_BLOCK)
     dataBlock = message[dataBlockStart:-1]
-    data = unescapeSysex(dataBlock)   
-    dummyName = " " * 20
-    data[107:107+20] = map(ord, dummyName)
-    fingerprint = hashlib.md5(bytearray(data)).hexdigest()    
-    return fingerprint
+    data = memoryview(unescapeSysex(dataBlock))
+    # Hash the data before the name, a blank name, and the data after the name. These are the same bytes the stored
+    # fingerprints were calculated from, also for data blocks ending before the end of the name.
+    fingerprint = hashlib.md5(data[:NAME_OFFSET])
+    fingerprint.update(_BLANK_NAME)
+    fingerprint.update(data[NAME_OFFSET + NAME_LENGTH:])
+    return fingerprint.hexdigest()
 
 
 def getDataBlockStart(message):
     """Returns the start index of the data block within a sysex message, or -1 if the data block cannot be found."""
-    if isSingleProgramDump(message):
+    messageType = _messageType(message)
+    if messageType == PROGRAM_DUMP:
         return 12
-    elif isEditBufferDump(message):
+    elif messageType == EDIT_BUFFER_DUMP:
         return 10
     else:
         return -1
 
 
 def convertToEditBuffer(channel, message):
-    if isEditBufferDump(message):
+    messageType = _messageType(message)
+    if messageType == EDIT_BUFFER_DUMP:
         return message
-    if isSingleProgramDump(message):
+    if messageType == PROGRAM_DUMP:
         # To turn a single program dump into an edit buffer dump, we need to remove the bank and program number,
         # and switch the command to 0b00000011
-        return message[0:9] + [0b00000011] + message[12:]
+        editBuffer = list(message)
+        editBuffer[9:12] = [EDIT_BUFFER_DUMP]
+        return editBuffer
     raise Exception("Data is neither edit buffer nor single program buffer from Toraiz AS-1")
 
 
 def convertToProgramDump(channel, message, program_number):
-    bank = getZeroBasedBankNumber(program_number)
-    program = program_number % numberOfPatchesPerBank()
-    if isEditBufferDump(message):
-        return message[0:9] + [0b00000010] + [bank, program] + message[10:]
-    elif isSingleProgramDump(message):
-        return message[0:10] + [bank, program] + message[12:]
+    bank, program = divmod(program_number, numberOfPatchesPerBank())
+    messageType = _messageType(message)
+    if messageType == EDIT_BUFFER_DUMP:
+        programDump = list(message)
+        programDump[9:10] = [PROGRAM_DUMP, bank, program]
+        return programDump
+    elif messageType == PROGRAM_DUMP:
+        programDump = list(message)
+        programDump[10:12] = [bank, program]
+        return programDump
     raise Exception("Neither edit buffer nor program dump - can't be converted")
 
 
 def unescapeSysex(sysex):
-    """Unpacks a 7-bit sysex message into 8-bit bytes."""
-    result = []
-    dataIndex = 0
-    while dataIndex < len(sysex):
-        msbits = sysex[dataIndex]
-        dataIndex += 1
-        for i in range(7):
-            if dataIndex < len(sysex):
-                result.append(sysex[dataIndex] | ((msbits & (1 << i)) << (7 - i)))
-            dataIndex += 1
+    """Unpacks a 7-bit sysex message into 8-bit bytes, returned as a bytearray."""
+    # Every group of 8 sysex bytes is one byte of msbits followed by 7 data columns, whose high bits come from
+    # _HIGH_BIT_OF_COLUMN
+    sysex = bytes(sysex)
+    msbits = sysex[0::8]
+    result = bytearray(len(sysex) - len(msbits))
+    for i in range(7):
+        data = sysex[i + 1::8]
+        low = int.from_bytes(data, 'little')
+        high = int.from_bytes(msbits.translate(_HIGH_BIT_OF_COLUMN[i])[:len(data)], 'little')
+        result[i::7] = (low | high).to_bytes(len(data), 'little')
     return result
 
 
 def escapeToSysex(message):
-    """Packs a message composed of 8-bit bytes into 7-bit sysex format."""
-    result = []
-    msBits = 0
-    byteIndex = 0
-    chunk = []
-    while byteIndex < len(message):
-        indexInChunk = byteIndex % 7
-        if indexInChunk == 0:
-            chunk = []
-        currentByte = message[byteIndex]
-        lsBits = currentByte & 0x7F
-        msBit = currentByte & 0x80
-        msBits |= msBit >> (7 - indexInChunk)
-        chunk.append(lsBits)
-        if indexInChunk == 6 or byteIndex == len(message) - 1:
-            chunk.insert(0, msBits)
-            result += chunk
-            msBits = 0
-        byteIndex += 1
+    """Packs a message composed of 8-bit bytes into 7-bit sysex format, returned as a bytearray."""
+    # Pad the data to full chunks of 7 bytes, so every chunk can be packed the same way without checking for the end
+    # of the data. The padding only produces bytes at the very end, which are cut off again.
+    padded = bytes(message) + bytes(-len(message) % 7)
+    chunks = len(padded) // 7
+    result = bytearray(chunks * 8)
+    # Mirroring unescapeSysex, treat the result as 8 columns. The 7 data columns are the low bits of every 7th byte,
+    # the msbits column collects the high bits of all 7 bytes of a chunk using translation tables and integer ORs
+    lowBits = padded.translate(_LOW_BITS)
+    msbits = 0
+    for i in range(7):
+        result[i + 1::8] = lowBits[i::7]
+        msbits |= int.from_bytes(padded[i::7].translate(_MSBIT_OF_COLUMN[i]), 'little')
+    result[0::8] = msbits.to_bytes(chunks, 'little')
+    del result[len(message) + (len(message) + 6) // 7:]
     return result
 
 
@@ -0,0 +1,94 @@
+#
+#   Copyright (c) 2022 Christof Ruch. All rights reserved.
+#
+#   Dual licensed: Distributed under Affero GPL license by default, an MIT license is available for purchase
+#
+import os
+
+from conftest import load_adaptation
+
+# The file name contains a hyphen, so it can't be imported as a module directly
+toraiz = load_adaptation(os.path.join(os.path.dirname(os.path.realpath(__file__)), "PioneerToraiz-AS1.py"))
+
+
+def make_patch_data(name, length=400):
+    data = bytearray((i * 37) & 0xff for i in range(length))
+    data[toraiz.NAME_OFFSET:toraiz.NAME_OFFSET + toraiz.NAME_LENGTH] = name.ljust(toraiz.NAME_LENGTH).encode()
+    return data
+
+
+def make_program_dump(patch_data, bank=3, program=42):
+    return toraiz.TORAIZ_HEADER + [toraiz.PROGRAM_DUMP, bank, program] + list(toraiz.escapeToSysex(patch_data)) + [0xf7]
+
+
+def test_escape_unescape():
+    assert list(toraiz.escapeToSysex([0xff] * 7)) == [0x7f] * 8
+    assert list(toraiz.escapeToSysex([0x80, 0x01, 0, 0, 0, 0, 0x80, 0x81])) == [0x41, 0, 1, 0, 0, 0, 0, 0, 0x01, 0x01]
+    assert list(toraiz.unescapeSysex([0x41, 0, 1, 0, 0, 0, 0, 0, 0x01, 0x01])) == [0x80, 0x01, 0, 0, 0, 0, 0x80, 0x81]
+
+    # Round trip including ragged tails, the high bit set in every other byte
+    for length in [0, 1, 6, 7, 8, 13, 14, 100, 401]:
+        data = [(i * 0x55 + 0x80 * (i % 2)) & 0xff for i in range(length)]
+        escaped = toraiz.escapeToSysex(data)
+        assert len(escaped) == length + (length + 6) // 7
+        assert all(x < 0x80 for x in escaped)
+        assert list(toraiz.unescapeSysex(escaped)) == data
+
+
+def test_rename_and_fingerprint():
+    program_dump = make_program_dump(make_patch_data("Original"))
+    assert toraiz.isSingleProgramDump(program_dump)
+    assert toraiz.nameFromDump(program_dump) == "Original".ljust(20)
+
+    renamed = toraiz.renamePatch(program_dump, "A new name that is too long")
+    assert isinstance(renamed, list)
+    assert len(renamed) == len(program_dump)
+    assert toraiz.nameFromDump(renamed) == "A new name that is t"
+    assert toraiz.nameFromDump(toraiz.renamePatch(program_dump, "Пётр")) == "????".ljust(20)
+
+    # The name doesn't count for the fingerprint, but everything else does
+    assert toraiz.calculateFingerprint(renamed) == toraiz.calculateFingerprint(program_dump)
+    changed_data = make_patch_data("Original")
+    changed_data[10] ^= 0x80
+    assert toraiz.calculateFingerprint(make_program_dump(changed_data)) != toraiz.calculateFingerprint(program_dump)
+
+    # A data block ending before the sysex groups holding the name gets the name appended
+    short_data = make_patch_data("")[:60]
+    short_dump = make_program_dump(short_data)
+    assert toraiz.nameFromDump(short_dump) == ""
+    renamed = toraiz.renamePatch(short_dump, "New")
+    assert len(renamed) == 12 + 80 + 12 + 1
+    assert renamed[-1] == 0xf7
+    assert toraiz.unescapeSysex(renamed[12:-1]) == short_data + b"New".ljust(20)
+    assert toraiz.nameFromDump(renamed) == ""
+
+    # A data block ending within the name is cut off after the new name
+    truncated_data = make_patch_data("Short name")[:115]
+    truncated_dump = make_program_dump(truncated_data)
+    assert toraiz.nameFromDump(truncated_dump) == "Short na"
+    renamed = toraiz.renamePatch(truncated_dump, "New")
+    assert len(renamed) == 12 + 127 + 19 + 1
+    assert renamed[-1] == 0xf7
+    assert toraiz.unescapeSysex(renamed[12:-1]) == truncated_data[:107] + b"New".ljust(20)
+    assert toraiz.nameFromDump(renamed) == "New".ljust(20)
+    assert toraiz.calculateFingerprint(renamed) == toraiz.calculateFingerprint(truncated_dump)
+
+
+def test_convert():
+    patch_data = make_patch_data("Convert me")
+    program_dump = make_program_dump(patch_data, bank=3, program=42)
+    data_block = program_dump[12:]
+
+    edit_buffer = toraiz.convertToEditBuffer(1, program_dump)
+    assert toraiz.isEditBufferDump(edit_buffer)
+    assert edit_buffer == toraiz.TORAIZ_HEADER + [toraiz.EDIT_BUFFER_DUMP] + data_block
+    assert toraiz.nameFromDump(edit_buffer) == "Convert me".ljust(20)
+    assert toraiz.convertToEditBuffer(1, edit_buffer) == edit_buffer
+
+    # Program number 512 is bank 5, program 12
+    program_prefix = toraiz.TORAIZ_HEADER + [toraiz.PROGRAM_DUMP]
+    assert toraiz.convertToProgramDump(1, edit_buffer, 512) == program_prefix + [5, 12] + data_block
+    assert toraiz.convertToProgramDump(1, program_dump, 999) == program_prefix + [9, 99] + data_block
+    assert toraiz.getDataBlockStart(program_dump) == 12
+    assert toraiz.getDataBlockStart(edit_buffer) == 10
+    assert toraiz.getDataBlockStart([0xf0, 0x7e, 0x7f, 0x06, 0x01, 0xf7]) == -1